@@ -4,91 +4,207 @@ import logging
 
 
 class AbstractDiff(ABC):
+    # Diff trees of large workspaces hold many nodes, so none of the diff classes carry a __dict__.
+    __slots__ = ("_str",)
+
     def __init__(self):
-        super().__init__()
+        self._str = None
 
-    @abstractmethod
     def __str__(self):
+        # Diff nodes are rendered repeatedly while logging, so the rendering is cached. Leaf nodes
+        # are immutable; DictDiff drops its cache whenever a child is added.
+        if self._str is None:
+            self._str = self._format()
+        return self._str
+
+    @abstractmethod
+    def _format(self):
         pass
 
 
 class Diff(AbstractDiff):
+    __slots__ = ("source", "destination")
+
     def __init__(self, source, destination):
         super().__init__()
         self.source = source
         self.destination = destination
 
     @abstractmethod
-    def __str__(self):
+    def _format(self):
         pass
 
 
-def _diff_message(hint, source, destination):
-    return f"{hint}:\n< {source}\n---\n> {destination}"
-
-
 _TYPE_DIFF_TYPE = "TYPE_MISMATCH"
 _VALUE_DIFF_TYPE = "VALUE_MISMATCH"
 
+# Static pieces of the rendered leaf diffs, so rendering is a single join.
+_TYPE_DIFF_HEADER = _TYPE_DIFF_TYPE + ":\n< "
+_VALUE_DIFF_HEADER = _VALUE_DIFF_TYPE + ":\n< "
+_DIFF_SEPARATOR = "\n---\n> "
+
+# Sides of a Miss, i.e. the side the value is missing from. They index the tuples below.
+SOURCE_SIDE = 0
+DESTINATION_SIDE = 1
+_MISS_TYPES = ("MISS_SOURCE", "MISS_DESTINATION")
+_MISS_HEADERS = ("MISS_SOURCE:\n> ", "MISS_DESTINATION:\n< ")
+
+
+def _diff_message(header, source, destination):
+    return "".join((header, str(source), _DIFF_SEPARATOR, str(destination)))
+
+
+def _typed_value(value):
+    return "".join((str(type(value)), "':'", str(value)))
+
 
 class TypeDiff(Diff):
+    __slots__ = ()
+
     def __init__(self, source, destination, counters):
         super().__init__(source, destination)
         counters[_TYPE_DIFF_TYPE] = counters[_TYPE_DIFF_TYPE] + 1
 
-    def __str__(self):
-        return _diff_message("TYPE_MISMATCH", f"{type(self.source)}':'{self.source}",
-                             f"{type(self.destination)}':'{self.destination}")
+    def _format(self):
+        return _diff_message(_TYPE_DIFF_HEADER, _typed_value(self.source),
+                             _typed_value(self.destination))
 
     def __eq__(self, other):
-        return str(self) == str(other)
+        return isinstance(other, TypeDiff) and \
+            type(self.source) is type(other.source) and self.source == other.source and \
+            type(self.destination) is type(other.destination) and \
+            self.destination == other.destination
 
 
 class ValueDiff(Diff):
+    __slots__ = ()
+
     def __init__(self, source, destination, counters):
         super().__init__(source, destination)
         counters[_VALUE_DIFF_TYPE] = counters[_VALUE_DIFF_TYPE] + 1
 
-    def __str__(self):
-        return _diff_message(_VALUE_DIFF_TYPE, self.source, self.destination)
+    def _format(self):
+        return _diff_message(_VALUE_DIFF_HEADER, self.source, self.destination)
 
     def __eq__(self, other):
-        return str(self) == str(other)
+        return isinstance(other, ValueDiff) and \
+            type(self.source) is type(other.source) and self.source == other.source and \
+            type(self.destination) is type(other.destination) and \
+            self.destination == other.destination
 
 
 class DictDiff(AbstractDiff):
+    __slots__ = ("children", "_sorted_keys")
+
     def __init__(self):
         super().__init__()
         self.children = {}
+        self._sorted_keys = None
 
-    def __str__(self):
-        return str({key: str(self.children[key]) for key in sorted(self.children.keys())})
+    def _format(self):
+        return str({key: str(self.children[key]) for key in self.sorted_keys()})
 
     def __eq__(self, other):
-        return str(self) == str(other)
+        return isinstance(other, DictDiff) and self.children == other.children
 
     def add_child(self, key, diff):
-        assert key not in self.children
+        # Keys are unique by construction in diff_json, so no membership check here.
         self.children[key] = diff
+        self._str = None
+        self._sorted_keys = None
+
+    def remove_child(self, key):
+        del self.children[key]
+        self._str = None
+        self._sorted_keys = None
+
+    def sorted_keys(self):
+        if self._sorted_keys is None:
+            try:
+                self._sorted_keys = tuple(sorted(self.children))
+            except TypeError:
+                # Set members of mixed types, e.g. None next to strings, have no natural order.
+                self._sorted_keys = tuple(
+                    sorted(self.children, key=lambda key: (type(key).__name__, str(key))))
+        return self._sorted_keys
 
     def has_diff(self):
         return len(self.children) > 0
 
 
 class Miss(AbstractDiff):
+    __slots__ = ("side", "value")
+
     def __init__(self, side, value, counters):
         super().__init__()
         self.side = side
         self.value = value
-        self.type = f"MISS_{self.side}"
-        counters[self.type] = counters[self.type] + 1
+        miss_type = _MISS_TYPES[side]
+        counters[miss_type] = counters[miss_type] + 1
 
-    def __str__(self):
-        value = f"< {self.value}" if self.side == "DESTINATION" else f"> {self.value}"
-        return f"{self.type}:\n{value}"
+    def _format(self):
+        return _MISS_HEADERS[self.side] + str(self.value)
 
     def __eq__(self, other):
-        return str(self) == str(other)
+        return isinstance(other, Miss) and self.side == other.side and \
+            type(self.value) is type(other.value) and self.value == other.value
+
+
+def _diff_primitive(source, destination, counters, stack):
+    if source != destination:
+        return ValueDiff(source, destination, counters)
+    return None
+
+
+def _diff_dict(source, destination, counters, stack):
+    diff = DictDiff()
+    for key, value in source.items():
+        if key in destination:
+            other = destination[key]
+            value_type = type(value)
+            if value_type is type(other) and value_type in _PRIMITIVE_TYPES:
+                # Flat primitive fields make up most of the payload, so they are compared here
+                # rather than through a stack frame each.
+                if value != other:
+                    diff.add_child(key, ValueDiff(value, other, counters))
+            else:
+                stack.append((value, other, diff, key))
+        else:
+            diff.add_child(key, Miss(DESTINATION_SIDE, value, counters))
+    for key, value in destination.items():
+        if key not in source:
+            diff.add_child(key, Miss(SOURCE_SIDE, value, counters))
+    return diff
+
+
+def _diff_set(source, destination, counters, stack):
+    missing_from_source = destination - source
+    missing_from_destination = source - destination
+    if not missing_from_source and not missing_from_destination:
+        return None
+    diff = DictDiff()
+    for key in missing_from_source:
+        diff.add_child(key, Miss(SOURCE_SIDE, key, counters))
+    for key in missing_from_destination:
+        diff.add_child(key, Miss(DESTINATION_SIDE, key, counters))
+    return diff
+
+
+# JSON scalars. bool is listed on its own since diff_json matches exact types, so True and 1 are
+# reported as a type mismatch rather than being equal.
+_PRIMITIVE_TYPES = (bool, int, float, str, type(None))
+
+# Handlers keyed by the exact type of both sides. Each returns the diff to attach to the parent, or
+# None, and pushes frames for nested values onto `stack`.
+# prepare_diff_input produces frozensets, but callers may pass plain sets; both compare alike.
+_SET_TYPES = (set, frozenset)
+
+_DIFF_HANDLERS = {
+    dict: _diff_dict,
+    set: _diff_set,
+    frozenset: _diff_set,
+    **dict.fromkeys(_PRIMITIVE_TYPES, _diff_primitive),
+}
 
 
 def diff_json(source, destination, counters):
@@ -97,42 +213,47 @@ def diff_json(source, destination, counters):
     It is required that input dicts only contains dict and prime data types. List is not supported
     intentionally to reduce the complexity.
 
+    The comparison walks the inputs with an explicit stack instead of recursion, so deeply nested
+    inputs are not bounded by the interpreter's recursion limit.
+
+    Values are compared by exact type, so 1, 1.0 and True are reported as TYPE_MISMATCH. The one
+    exception are members of sets, which Python compares by value: {1} and {True} are equal.
+
     :param source - source hand side of the comparison.
     :param destination - destination hand side of the comparison.
     :param counters - a default dict to counter different types of diffs.
     """
-    if type(source) != type(destination):
-        return TypeDiff(source, destination, counters)
-
-    if isinstance(source, (int, float, str)):
-        if source != destination:
-            return ValueDiff(source, destination, counters)
-    elif isinstance(source, dict):
-        diff = DictDiff()
-        for key in set(source.keys()).union(set(destination.keys())):
-            if key not in source:
-                diff.add_child(key, Miss('SOURCE', destination[key], counters))
-            elif key not in destination:
-                diff.add_child(key, Miss('DESTINATION', source[key], counters))
-            else:
-                child_diff = diff_json(source[key], destination[key], counters)
-                if child_diff:
-                    diff.add_child(key, child_diff)
-        if diff.has_diff():
-            return diff
-    elif isinstance(source, set):
-        diff = DictDiff()
-        for key in source.union(destination):
-            if key not in source:
-                diff.add_child(key, Miss('SOURCE', key, counters))
-            elif key not in destination:
-                diff.add_child(key, Miss('DESTINATION', key, counters))
-        if diff.has_diff():
-            return diff
-    else:
-        raise NotImplementedError(f"Type {type(source)} is not supported.")
-
-    return None
+    # The root is a sentinel holding the top level diff under the key None.
+    root = DictDiff()
+    stack = [(source, destination, root, None)]
+    # DictDiffs of nested dicts are attached to their parent when created and pruned afterwards if
+    # they turn out to be empty. Children are always created after their parents, so walking this
+    # list backwards prunes bottom up.
+    dict_diffs = []
+    while stack:
+        source, destination, parent, parent_key = stack.pop()
+        source_type = type(source)
+        if source_type is not type(destination) and \
+                not (source_type in _SET_TYPES and type(destination) in _SET_TYPES):
+            parent.add_child(parent_key, TypeDiff(source, destination, counters))
+            continue
+        handler = _DIFF_HANDLERS.get(source_type)
+        if handler is None:
+            raise NotImplementedError(f"Type {source_type} is not supported.")
+        if source is destination:
+            # Shared sub-structures are equal by definition.
+            continue
+        diff = handler(source, destination, counters, stack)
+        if diff is not None:
+            parent.add_child(parent_key, diff)
+            if source_type is dict:
+                dict_diffs.append((parent, parent_key, diff))
+
+    for parent, parent_key, diff in reversed(dict_diffs):
+        if not diff.has_diff():
+            parent.remove_child(parent_key)
+
+    return root.children.get(None)
 
 
 _HASH_PRIMARY_KEY = "__HASH__"
@@ -151,12 +272,12 @@ class DiffConfig:
     1) The field name to be used as the primary key.
     2) A list of field names that can be used as the primary key. If multiple fields exist in the
     inner dict, the first appearance in the list will be used.
-    3) "__HASH__" the hash of the inner dict will be used as the key.
+    3) "__HASH__" the content of the inner dict will be used as the key.
     """
 
     def __init__(self, primary_key=None, ignored_keys=None, children=None):
         self.primary_key = primary_key
-        self.ignore_keys = ignored_keys
+        self.ignore_keys = frozenset(ignored_keys) if ignored_keys else None
         self.children = children
 
 
@@ -169,10 +290,89 @@ def init_diff_logger(base_dir):
     logging.basicConfig(format="", handlers=[ch, fh], level=logging.DEBUG, force=True)
 
 
+def _content_hash(value):
+    """Hashes a prepared value consistently with _content_equal. Dict items are combined in an
+    order independent way, so the order of fields does not matter.
+    """
+    value_type = type(value)
+    if value_type is dict:
+        items_hash = 0
+        for k, v in value.items():
+            items_hash ^= hash((k, _content_hash(v)))
+        return hash((dict, items_hash))
+    return hash((value_type, value))
+
+
+def _content_equal(source, destination):
+    """Like ==, except that values of different types (e.g. 1, 1.0 and True) are never equal."""
+    value_type = type(source)
+    if value_type is not type(destination):
+        return False
+    if value_type is dict:
+        if len(source) != len(destination):
+            return False
+        for k, v in source.items():
+            if k not in destination or not _content_equal(v, destination[k]):
+                return False
+        return True
+    return source == destination
+
+
+def _render_content(value):
+    """Renders a prepared value like str(), but with dict items and set members sorted so that
+    the result does not depend on insertion order or on the hash seed.
+    """
+    value_type = type(value)
+    if value_type is dict:
+        items = sorted((_render_content(k), _render_content(v)) for k, v in value.items())
+        return "{" + ", ".join(f"{k}: {v}" for k, v in items) + "}"
+    elif value_type in (set, frozenset):
+        if not value:
+            return "set()"
+        return "{" + ", ".join(sorted(_render_content(v) for v in value)) + "}"
+    elif value_type is _ContentKey:
+        return str(value)
+    return repr(value)
+
+
+class _ContentKey:
+    """Primary key of a dict keyed by "__HASH__". Two keys are equal iff the contents of their
+    dicts, including the types of all values, are equal. The key only references the prepared
+    dict, which is kept anyway, and renders it lazily for ordering and logging.
+    """
+    __slots__ = ("data", "_hash", "_str")
+
+    def __init__(self, data):
+        self.data = data
+        self._hash = _content_hash(data)
+        self._str = None
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, _ContentKey):
+            return NotImplemented
+        return self.data is other.data or \
+            (self._hash == other._hash and _content_equal(self.data, other.data))
+
+    def __lt__(self, other):
+        if not isinstance(other, _ContentKey):
+            return NotImplemented
+        return str(self) < str(other)
+
+    def __str__(self):
+        if self._str is None:
+            self._str = _render_content(self.data)
+        return self._str
+
+    __repr__ = __str__
+
+
 def _get_primary_key(data, primary_key):
     if isinstance(primary_key, str):
         if primary_key == _HASH_PRIMARY_KEY:
-            return str(data)
+            return _ContentKey(data)
         else:
             return data.get(primary_key, None)
     elif isinstance(primary_key, list):
@@ -190,7 +390,8 @@ def _get_primary_key(data, primary_key):
 
 def prepare_diff_input(data, config=None):
     """ This function converts input data with the two rules below:
-    1) List of primary types to sets.
+    1) List of primary types to frozensets. Members that compare equal collapse into one, e.g.
+    [1, True] becomes {1}.
     2) List of dict to dict of dicts keyed by primary key.
 
     :param data: on side of input for diffing.
@@ -202,8 +403,8 @@ def prepare_diff_input(data, config=None):
     if isinstance(data, list):
         if len(data) == 0:
             return {}
-        elif isinstance(data[0], (int, float, str)):
-            return set(data)
+        elif isinstance(data[0], _PRIMITIVE_TYPES):
+            return frozenset(data)
         elif isinstance(data[0], dict):
             assert isinstance(config, DiffConfig) and config.primary_key, \
                 f"Config missing for {str(data)}"
@@ -212,12 +413,11 @@ def prepare_diff_input(data, config=None):
                 converted = prepare_diff_input(inner, config)
                 key = _get_primary_key(converted, config.primary_key)
                 if key is None:
-                    logging.info(f"No keys {str(config.primary_key)} found in {str(inner)}")
-                elif key not in result:
-                    result[key] = converted
-                else:
-                    logging.info(f"Duplicates found:\n{str(converted)}\n---\n" +
-                                 str(result[key]))
+                    logging.info("No keys %s found in %s", config.primary_key, inner)
+                    continue
+                existing = result.setdefault(key, converted)
+                if existing is not converted:
+                    logging.info("Duplicates found:\n%s\n---\n%s", converted, existing)
 
             return result
         else:
@@ -226,33 +426,85 @@ def prepare_diff_input(data, config=None):
         if len(data) == 0:
             return {}
         assert not config or isinstance(config, DiffConfig)
-        result = {}
-        for key, value in data.items():
-            if config and config.ignore_keys and key in config.ignore_keys:
-                continue
-            else:
-                child_config = None
-                if config and config.children:
-                    child_config = config.children.get(key, None)
-                result[key] = prepare_diff_input(value, child_config)
-
-        return result
-    elif isinstance(data, (int, float, str)):
+        ignore_keys = config.ignore_keys if config and config.ignore_keys else frozenset()
+        children = config.children if config and config.children else None
+        if children is None:
+            return {key: prepare_diff_input(value)
+                    for key, value in data.items() if key not in ignore_keys}
+        return {key: prepare_diff_input(value, children.get(key, None))
+                for key, value in data.items() if key not in ignore_keys}
+    elif isinstance(data, _PRIMITIVE_TYPES):
         return data
     else:
         raise NotImplementedError(f"Type {type(data)} is not supported.")
 
 
+def collect_messages(diff, prefix=""):
+    """Flattens a diff into parallel lists of the paths of all leaf diffs and the leaves
+    themselves, in sorted path order, and lists the subtrees stored under empty keys.
+
+    :param diff: the diff returned by diff_json.
+    :param prefix: the path prefix of `diff`.
+    :return: a tuple of (paths, leaves, empty_key_subtrees). The last one lists (index, subtree)
+    for every subtree stored under an empty or None key, where index is the position of its first
+    leaf in `paths`.
+    """
+    paths = []
+    leaves = []
+    empty_key_subtrees = []
+    # Depth first walk with an explicit stack. Each frame carries the path components leading to
+    # the node; they are only joined when a leaf is reached. Children are pushed in reverse order so
+    # they are popped in sorted order.
+    stack = [(diff, [prefix], False)]
+    while stack:
+        node, path, empty_key = stack.pop()
+        if empty_key:
+            empty_key_subtrees.append((len(paths), node))
+        if isinstance(node, (TypeDiff, ValueDiff, Miss)):
+            paths.append("|".join(path))
+            leaves.append(node)
+        elif isinstance(node, DictDiff):
+            for key in reversed(node.sorted_keys()):
+                stack.append((node.children[key], path + [str(key)], _is_empty_key(key)))
+        else:
+            raise NotImplementedError(f"Type {type(node)} is not supported.")
+    return paths, leaves, empty_key_subtrees
+
+
+def _is_empty_key(key):
+    return key == "" or key is None
+
+
+def _report_empty_key_subtrees(diff):
+    """Logs the subtrees stored under empty keys, without building any leaf output."""
+    stack = [(diff, False)]
+    while stack:
+        node, empty_key = stack.pop()
+        if empty_key:
+            logging.error("\n\n\n%s\n\n\n", node)
+        if isinstance(node, DictDiff):
+            for key in reversed(node.sorted_keys()):
+                stack.append((node.children[key], _is_empty_key(key)))
+
+
 def print_diff(diff, prefix=""):
     if not diff:
         logging.info("No diff found.")
-    elif isinstance(diff, (TypeDiff, ValueDiff, Miss)):
-        logging.debug(prefix + ":" + str(diff) + "\n")
-    elif isinstance(diff, DictDiff):
-        for key in sorted(diff.children.keys()):
-            value = diff.children[key]
-            if not key:
-                logging.error("\n\n\n" + str(value) + "\n\n\n")
-            print_diff(value, prefix + "|" + key)
-    else:
-        raise NotImplementedError(f"Type {type(diff)} is not supported.")
+        return
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        _report_empty_key_subtrees(diff)
+        return
+
+    paths, leaves, empty_key_subtrees = collect_messages(diff, prefix)
+    lines = [f"{path}:{leaf}\n" for path, leaf in zip(paths, leaves)]
+    # Leaves go out in as few records as possible, so the handlers are locked and written once per
+    # run of leaves rather than once per leaf. Subtrees under empty keys are reported right before
+    # their leaves.
+    start = 0
+    for index, subtree in empty_key_subtrees:
+        if index > start:
+            logging.debug("\n".join(lines[start:index]))
+            start = index
+        logging.error("\n\n\n%s\n\n\n", subtree)
+    if start < len(lines):
+        logging.debug("\n".join(lines[start:]))
@@ -1,4 +1,5 @@
 import unittest
+import logging
 from .json_diff import *
 from collections import defaultdict
 
@@ -15,6 +16,33 @@ class JsonDiffTest(unittest.TestCase):
                                          {'i': 1, 'f': 2.0, 's': 'hello world'}, counters))
         self.assertFalse(counters)
 
+    def test_equal_values_of_different_types(self):
+        counters = defaultdict(int)
+        expected_counters = defaultdict(int)
+        expected = DictDiff()
+        expected.add_child('a', TypeDiff(True, 1, expected_counters))
+        self.assertEqual(expected, diff_json({'a': True, 'b': 1}, {'a': 1, 'b': 1}, counters))
+        nested = DictDiff()
+        nested.add_child('a', TypeDiff(1, 1.0, expected_counters))
+        expected = DictDiff()
+        expected.add_child('n', nested)
+        self.assertEqual(expected, diff_json({'n': {'a': 1}}, {'n': {'a': 1.0}}, counters))
+        self.assertEqual(counters, expected_counters)
+        self.assertEqual(dict(counters), {'TYPE_MISMATCH': 2})
+
+    def test_unsupported_type(self):
+        shared = [1]
+        for source, destination in (([1], [2]), ([1], [1]), (shared, shared)):
+            with self.assertRaises(NotImplementedError):
+                diff_json({'a': source}, {'a': destination}, defaultdict(int))
+
+    def test_shared_subtree(self):
+        counters = defaultdict(int)
+        shared = {'a': {'b': 1}, 's': {'x', 'y'}}
+        self.assertEqual(None, diff_json(shared, shared, counters))
+        self.assertEqual(None, diff_json({'n': shared}, {'n': shared}, counters))
+        self.assertFalse(counters)
+
     def test_value_diff(self):
         counters = defaultdict(int)
         expected_counters = defaultdict(int)
@@ -34,6 +62,26 @@ class JsonDiffTest(unittest.TestCase):
         self.assertEqual(counters, expected_counters)
         self.assertEqual(dict(counters), {'TYPE_MISMATCH': 4})
 
+    def test_bool_and_none(self):
+        counters = defaultdict(int)
+        expected_counters = defaultdict(int)
+        self.assertEqual(None, diff_json({'b': True, 'n': None}, {'b': True, 'n': None}, counters))
+        self.assertEqual(ValueDiff(True, False, expected_counters),
+                         diff_json(True, False, counters))
+        self.assertEqual(TypeDiff(True, 1, expected_counters), diff_json(True, 1, counters))
+        self.assertEqual(TypeDiff(None, 'x', expected_counters), diff_json(None, 'x', counters))
+        self.assertEqual(counters, expected_counters)
+        self.assertEqual(dict(counters), {'VALUE_MISMATCH': 1, 'TYPE_MISMATCH': 2})
+
+    def test_set_members_compare_by_value(self):
+        # Known limitation: set members are matched by value, so their types are not compared.
+        counters = defaultdict(int)
+        self.assertEqual(frozenset({1}), prepare_diff_input([1, True]))
+        self.assertEqual(None, diff_json(prepare_diff_input([True]), prepare_diff_input([1]),
+                                         counters))
+        self.assertEqual(None, diff_json(frozenset({1}), frozenset({1.0}), counters))
+        self.assertFalse(counters)
+
     def test_dict_diff(self):
         counters = defaultdict(int)
         expected_counters = defaultdict(int)
@@ -41,8 +89,8 @@ class JsonDiffTest(unittest.TestCase):
         expected.add_child('i', ValueDiff(1, 2, expected_counters))
         expected.add_child('f', TypeDiff(2.0, 3, expected_counters))
         expected.add_child('s', ValueDiff('hello', 'world', expected_counters))
-        expected.add_child('l', Miss('DESTINATION', 'source', expected_counters))
-        expected.add_child('r', Miss('SOURCE', 'destination', expected_counters))
+        expected.add_child('l', Miss(DESTINATION_SIDE, 'source', expected_counters))
+        expected.add_child('r', Miss(SOURCE_SIDE, 'destination', expected_counters))
         self.assertEqual(expected, diff_json({'i': 1, 'f': 2.0, 's': 'hello', 'l': 'source'},
                                              {'f': 3, 's': 'world', 'i': 2, 'r': 'destination'},
                                              counters))
@@ -54,13 +102,48 @@ class JsonDiffTest(unittest.TestCase):
         counters = defaultdict(int)
         expected_counters = defaultdict(int)
         expected = DictDiff()
-        expected.add_child('source', Miss('DESTINATION', 'source', expected_counters))
-        expected.add_child('destination', Miss('SOURCE', 'destination', expected_counters))
+        expected.add_child('source', Miss(DESTINATION_SIDE, 'source', expected_counters))
+        expected.add_child('destination', Miss(SOURCE_SIDE, 'destination', expected_counters))
         self.assertEqual(expected, diff_json({'source', 'common'},
                                              {'destination', 'common'}, counters))
         self.assertEqual(counters, expected_counters)
         self.assertEqual(dict(counters), {'MISS_DESTINATION': 1, 'MISS_SOURCE': 1})
 
+    def test_mixed_type_set_diff(self):
+        counters = defaultdict(int)
+        diff = diff_json(prepare_diff_input(['a', None, 1, False]), prepare_diff_input(['a']),
+                         counters)
+        self.assertEqual((None, False, 1), diff.sorted_keys())
+        self.assertEqual(dict(counters), {'MISS_DESTINATION': 3})
+
+    def test_mixed_hash_and_plain_keys(self):
+        # One side keyed by "__HASH__", the other a plain dict at the same path.
+        counters = defaultdict(int)
+        diff = diff_json(prepare_diff_input([{'p': 1}], DiffConfig(primary_key='__HASH__')),
+                         {'x': 1}, counters)
+        self.assertEqual(["{'p': 1}", 'x'], [str(key) for key in diff.sorted_keys()])
+        self.assertEqual(dict(counters), {'MISS_DESTINATION': 1, 'MISS_SOURCE': 1})
+
+    def test_frozenset_diff(self):
+        counters = defaultdict(int)
+        expected_counters = defaultdict(int)
+        expected = DictDiff()
+        expected.add_child('source', Miss(DESTINATION_SIDE, 'source', expected_counters))
+        self.assertEqual(expected, diff_json(prepare_diff_input(['source', 'common']),
+                                             prepare_diff_input(['common']), counters))
+        self.assertEqual(None, diff_json(prepare_diff_input(['a', 'b']),
+                                         prepare_diff_input(['b', 'a']), counters))
+        self.assertEqual(counters, expected_counters)
+
+    def test_set_and_frozenset(self):
+        counters = defaultdict(int)
+        self.assertEqual(None, diff_json({'a': {1}}, prepare_diff_input({'a': [1]}), counters))
+        expected_counters = defaultdict(int)
+        expected = DictDiff()
+        expected.add_child(2, Miss(SOURCE_SIDE, 2, expected_counters))
+        self.assertEqual(expected, diff_json({1}, frozenset({1, 2}), counters))
+        self.assertEqual(counters, expected_counters)
+
     def test_nested_dict_diff(self):
         counters = defaultdict(int)
         expected_counters = defaultdict(int)
@@ -70,8 +153,8 @@ class JsonDiffTest(unittest.TestCase):
 
         expected2 = DictDiff()
         expected2.add_child('s', ValueDiff('hello', 'world', expected_counters))
-        expected2.add_child('l', Miss('DESTINATION', 'source', expected_counters))
-        expected2.add_child('r', Miss('SOURCE', 'destination', expected_counters))
+        expected2.add_child('l', Miss(DESTINATION_SIDE, 'source', expected_counters))
+        expected2.add_child('r', Miss(SOURCE_SIDE, 'destination', expected_counters))
         expected1.add_child('n', expected2)
         self.assertEqual(expected1, diff_json(
             {'i': 1, 'f': 2.0, 'e': 'equal', 'n': {'s': 'hello', 'l': 'source'}},
@@ -80,6 +163,44 @@ class JsonDiffTest(unittest.TestCase):
         self.assertEqual(dict(counters), {
             'TYPE_MISMATCH': 1, 'VALUE_MISMATCH': 2, 'MISS_DESTINATION': 1, 'MISS_SOURCE': 1})
 
+    def test_deep_nested_dict_diff(self):
+        def nested(value, depth=2000):
+            data = {'v': value}
+            for _ in range(depth):
+                data = {'n': data}
+            return data
+
+        counters = defaultdict(int)
+        self.assertEqual(None, diff_json(nested(1), nested(1), counters))
+        self.assertIsInstance(diff_json(nested(1), nested(2), counters), DictDiff)
+        self.assertEqual(dict(counters), {'VALUE_MISMATCH': 1})
+
+    def test_diff_equality(self):
+        counters = defaultdict(int)
+        self.assertNotEqual(ValueDiff(1, 2, counters), TypeDiff(1, 2, counters))
+        self.assertNotEqual(TypeDiff(1, 'x', counters), TypeDiff(1.0, 'x', counters))
+        self.assertNotEqual(ValueDiff(1, 2, counters), ValueDiff(1.0, 2.0, counters))
+        self.assertNotEqual(Miss(SOURCE_SIDE, 1, counters), Miss(SOURCE_SIDE, True, counters))
+        self.assertNotEqual(Miss(SOURCE_SIDE, 'a', counters), Miss(DESTINATION_SIDE, 'a', counters))
+        self.assertNotEqual(DictDiff(), None)
+        left = DictDiff()
+        left.add_child('a', Miss(SOURCE_SIDE, 'a', counters))
+        right = DictDiff()
+        right.add_child('a', Miss(SOURCE_SIDE, 'a', counters))
+        self.assertEqual(left, right)
+        right.add_child('b', ValueDiff(1, 2, counters))
+        self.assertNotEqual(left, right)
+
+    def test_str_cache(self):
+        counters = defaultdict(int)
+        diff = DictDiff()
+        diff.add_child('a', Miss(SOURCE_SIDE, 'a', counters))
+        before = str(diff)
+        self.assertIs(before, str(diff))
+        diff.add_child('b', ValueDiff(1, 2, counters))
+        self.assertNotEqual(before, str(diff))
+        self.assertIn('VALUE_MISMATCH', str(diff))
+
 
 class PrepareDiffInputTest(unittest.TestCase):
     def test_no_change(self):
@@ -87,12 +208,15 @@ class PrepareDiffInputTest(unittest.TestCase):
         self.assertEqual(2.0, prepare_diff_input(2.0))
         self.assertEqual('hello', prepare_diff_input('hello'))
         self.assertEqual({}, prepare_diff_input({}))
+        self.assertEqual(None, prepare_diff_input(None))
+        self.assertEqual({'b': False, 'n': None}, prepare_diff_input({'b': False, 'n': None}))
 
     def test_prime_list(self):
         self.assertEqual({}, prepare_diff_input([]))
         self.assertEqual({1, 2, 3}, prepare_diff_input([1, 2, 3]))
         self.assertEqual({1.0, 2.0, 3.0}, prepare_diff_input([1.0, 2.0, 3.0]))
         self.assertEqual({'1', '3', '2'}, prepare_diff_input(['1', '2', '3']))
+        self.assertIsInstance(prepare_diff_input([1, 2, 3]), frozenset)
 
     def test_list_of_dict(self):
         self.assertEqual(
@@ -189,38 +313,71 @@ class PrepareDiffInputTest(unittest.TestCase):
         )
 
     def test_hash_key(self):
-        self.maxDiff = None
+        config = DiffConfig(children={
+            'foo':
+                DiffConfig(
+                    primary_key='__HASH__',
+                    children={
+                        'info': DiffConfig(primary_key='id')
+                    }
+                )
+        })
+        prepared = prepare_diff_input(
+            {
+                'foo': [
+                    {'key': 'b', 'value': 'y', 'info': [{'id': 100, 'v': '111'}]},
+                    {'key': 'c', 'value': 'n', 'info': [{'id': 300, 'v': '333'}]},
+                    {'key': 'a', 'value': 'q', 'info': [{'id': 200, 'v': '222'}]},
+                ],
+                'bar': 'baz',
+            },
+            config)
         self.assertEqual(
             {
                 'foo': {
-                    "{'key': 'b', 'value': 'y', 'info': {100: {'id': 100, 'v': '111'}}}":
+                    "{'info': {100: {'id': 100, 'v': '111'}}, 'key': 'b', 'value': 'y'}":
                         {'key': 'b', 'value': 'y', 'info': {100: {'id': 100, 'v': '111'}}},
-                    "{'key': 'a', 'value': 'q', 'info': {200: {'id': 200, 'v': '222'}}}":
+                    "{'info': {200: {'id': 200, 'v': '222'}}, 'key': 'a', 'value': 'q'}":
                         {'key': 'a', 'value': 'q', 'info': {200: {'id': 200, 'v': '222'}}},
-                    "{'key': 'c', 'value': 'n', 'info': {300: {'id': 300, 'v': '333'}}}":
+                    "{'info': {300: {'id': 300, 'v': '333'}}, 'key': 'c', 'value': 'n'}":
                         {'key': 'c', 'value': 'n', 'info': {300: {'id': 300, 'v': '333'}}}
                 },
                 'bar': 'baz'
             },
-            prepare_diff_input(
-                {
-                    'foo': [
-                        {'key': 'b', 'value': 'y', 'info': [{'id': 100, 'v': '111'}]},
-                        {'key': 'c', 'value': 'n', 'info': [{'id': 300, 'v': '333'}]},
-                        {'key': 'a', 'value': 'q', 'info': [{'id': 200, 'v': '222'}]},
-                    ],
-                    'bar': 'baz',
-                },
-                DiffConfig(children={
-                    'foo':
-                        DiffConfig(
-                            primary_key='__HASH__',
-                            children={
-                                'info': DiffConfig(primary_key='id')
-                            }
-                        )
-                }))
-        )
+            {'foo': {str(key): value for key, value in prepared['foo'].items()},
+             'bar': prepared['bar']})
+
+        # The key only depends on the content, not on the order of fields.
+        reordered = prepare_diff_input(
+            {
+                'foo': [
+                    {'info': [{'v': '111', 'id': 100}], 'value': 'y', 'key': 'b'},
+                    {'info': [{'v': '333', 'id': 300}], 'value': 'n', 'key': 'c'},
+                    {'info': [{'v': '222', 'id': 200}], 'value': 'q', 'key': 'a'},
+                ],
+                'bar': 'baz',
+            },
+            config)
+        self.assertEqual(None, diff_json(prepared, reordered, defaultdict(int)))
+
+    def test_hash_key_types(self):
+        config = DiffConfig(primary_key='__HASH__')
+        prepared = prepare_diff_input(
+            [{'p': 1}, {'p': True}, {'p': 1.0}, {'p': 'x'}, {'p': ['b', 'a', 'c']}], config)
+        self.assertEqual(5, len(prepared))
+        self.assertEqual(["{'p': 'x'}", "{'p': 1.0}", "{'p': 1}", "{'p': True}",
+                          "{'p': {'a', 'b', 'c'}}"],
+                         [str(key) for key in sorted(prepared)])
+        # Content keys are not ordered against other key types.
+        with self.assertRaises(TypeError):
+            sorted(['x', *prepared])
+
+        counters = defaultdict(int)
+        diff = diff_json(prepared, prepare_diff_input([{'p': 1}, {'p': ['c', 'b', 'a']}], config),
+                         counters)
+        self.assertEqual(dict(counters), {'MISS_DESTINATION': 3})
+        self.assertEqual(["{'p': 'x'}", "{'p': 1.0}", "{'p': True}"],
+                         [str(key) for key in diff.sorted_keys()])
 
     def test_multiple_keys(self):
         self.assertEqual(
@@ -286,6 +443,13 @@ class PrepareDiffInputTest(unittest.TestCase):
                 }))
         )
 
+    def test_ignore_list(self):
+        config = DiffConfig(ignored_keys=['value', 'v'])
+        self.assertEqual(frozenset({'value', 'v'}), config.ignore_keys)
+        self.assertEqual({'key': 'b'},
+                         prepare_diff_input({'key': 'b', 'value': 'y', 'v': 1}, config))
+        self.assertIsNone(DiffConfig(ignored_keys=[]).ignore_keys)
+
     def test_duplicates(self):
         self.assertEqual(
             {
@@ -311,6 +475,16 @@ class PrepareDiffInputTest(unittest.TestCase):
                         )
                 })))
 
+    def test_duplicates_logged(self):
+        with self.assertLogs(level=logging.INFO) as logs:
+            result = prepare_diff_input(
+                [{'key': 'c', 'value': 'n'}, {'key': 'c', 'value': 'm'}],
+                DiffConfig(primary_key='key'))
+        self.assertEqual({'c': {'key': 'c', 'value': 'n'}}, result)
+        self.assertEqual(["Duplicates found:\n{'key': 'c', 'value': 'm'}\n---\n"
+                          "{'key': 'c', 'value': 'n'}"],
+                         [record.getMessage() for record in logs.records])
+
 
 class PrintDiffTest(unittest.TestCase):
     def test_simple(self):
@@ -321,13 +495,88 @@ class PrintDiffTest(unittest.TestCase):
         expected1.add_child('f', TypeDiff(2.0, 3, counters))
         expected2 = DictDiff()
         expected2.add_child('s', ValueDiff('hello', 'world', counters))
-        expected2.add_child('l', Miss('DESTINATION', 'source', counters))
-        expected2.add_child('r', Miss('SOURCE', 'destination', counters))
+        expected2.add_child('l', Miss(DESTINATION_SIDE, 'source', counters))
+        expected2.add_child('r', Miss(SOURCE_SIDE, 'destination', counters))
         expected1.add_child('n', expected2)
         print_diff(expected1, prefix="SIMPLE")
         # TODO(Yubing): Check output.
         self.assertTrue(True)
 
+    def test_paths_and_order(self):
+        counters = defaultdict(int)
+        inner = DictDiff()
+        inner.add_child('s', ValueDiff('hello', 'world', counters))
+        inner.add_child('r', Miss(SOURCE_SIDE, 'destination', counters))
+        outer = DictDiff()
+        outer.add_child('z', Miss(DESTINATION_SIDE, 'source', counters))
+        outer.add_child('n', inner)
+        paths, leaves, _ = collect_messages(outer, prefix="P")
+        self.assertEqual(["P|n|r", "P|n|s", "P|z"], paths)
+        self.assertEqual([Miss(SOURCE_SIDE, 'destination', counters),
+                          ValueDiff('hello', 'world', counters),
+                          Miss(DESTINATION_SIDE, 'source', counters)], leaves)
+
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            print_diff(outer, prefix="P")
+        self.assertEqual(1, len(logs.records))
+        self.assertEqual(
+            "P|n|r:MISS_SOURCE:\n> destination\n\n"
+            "P|n|s:VALUE_MISMATCH:\n< hello\n---\n> world\n\n"
+            "P|z:MISS_DESTINATION:\n< source\n",
+            logs.records[0].getMessage())
+
+    def test_empty_keys(self):
+        counters = defaultdict(int)
+        empty = DictDiff()
+        empty.add_child('v', ValueDiff(1, 2, counters))
+        nested = DictDiff()
+        nested.add_child('', empty)
+        nested.add_child('x', Miss(SOURCE_SIDE, 'x', counters))
+        members = DictDiff()
+        members.add_child(False, Miss(SOURCE_SIDE, False, counters))
+        nones = DictDiff()
+        nones.add_child(None, Miss(SOURCE_SIDE, None, counters))
+        numbers = DictDiff()
+        numbers.add_child(0, Miss(SOURCE_SIDE, 0, counters))
+        outer = DictDiff()
+        outer.add_child('a', Miss(SOURCE_SIDE, 'a', counters))
+        outer.add_child('n', nested)
+        outer.add_child('s', members)
+        outer.add_child('t', nones)
+        outer.add_child('z', numbers)
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            print_diff(outer, prefix="P")
+        # Empty and None keys are reported right before their leaves; False and 0 are regular keys.
+        self.assertEqual(
+            [(logging.DEBUG, "P|a:MISS_SOURCE:\n> a\n"),
+             (logging.ERROR, "\n\n\n" + str(empty) + "\n\n\n"),
+             (logging.DEBUG, "P|n||v:VALUE_MISMATCH:\n< 1\n---\n> 2\n\n"
+                             "P|n|x:MISS_SOURCE:\n> x\n\n"
+                             "P|s|False:MISS_SOURCE:\n> False\n"),
+             (logging.ERROR, "\n\n\n" + str(nones.children[None]) + "\n\n\n"),
+             (logging.DEBUG, "P|t|None:MISS_SOURCE:\n> None\n\n"
+                             "P|z|0:MISS_SOURCE:\n> 0\n")],
+            [(record.levelno, record.getMessage()) for record in logs.records])
+
+    def test_debug_disabled(self):
+        counters = defaultdict(int)
+        empty = DictDiff()
+        empty.add_child('v', ValueDiff(1, 2, counters))
+        nested = DictDiff()
+        nested.add_child(None, Miss(SOURCE_SIDE, None, counters))
+        diff = DictDiff()
+        diff.add_child('', empty)
+        diff.add_child('a', Miss(SOURCE_SIDE, 'a', counters))
+        diff.add_child('n', nested)
+        # assertLogs lowers the level to INFO only while capturing, so DEBUG is disabled here.
+        with self.assertLogs(level=logging.INFO) as logs:
+            print_diff(diff, prefix="P")
+        # Leaves are not logged, but subtrees under empty keys are still reported.
+        self.assertEqual(
+            [(logging.ERROR, "\n\n\n" + str(empty) + "\n\n\n"),
+             (logging.ERROR, "\n\n\n" + str(nested.children[None]) + "\n\n\n")],
+            [(record.levelno, record.getMessage()) for record in logs.records])
+
 
 if __name__ == '__main__':
     unittest.main()